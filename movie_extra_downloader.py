@@ -17,6 +17,7 @@ import time
 import shutil
 import json
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 import yt_dlp
 from _socket import timeout
 from requests import Request, Session
@@ -153,6 +154,19 @@ def search_tmdb_by_id(tmdb_id, extra_types, media_type):
     return ret_url_list
 
 
+def get_prefetch_path(directory):
+    return os.path.join(settings.prefetch_folder, os.path.split(directory)[1] + '.json')
+
+
+def estimate_video_size(youtube_video):
+    size = youtube_video.get('filesize') or youtube_video.get('filesize_approx')
+    if not size:
+        # merged formats only report sizes on the requested video and audio streams
+        size = sum(requested_format.get('filesize') or requested_format.get('filesize_approx') or 0
+                   for requested_format in youtube_video.get('requested_formats') or [])
+    return size or 0
+
+
 class ExtraFinder:
 
     conn_errors = 0
@@ -171,11 +185,16 @@ class ExtraFinder:
 
             def get_video_data():
                 youtube_info = None
+                arguments = {'quiet': True,
+                             'socket_timeout': '3',
+                             'logger': log}
+                # pick the same formats the download will, so format and size match it
+                for key in ('format', 'format_sort', 'merge_output_format'):
+                    if key in settings.youtube_dl_arguments:
+                        arguments[key] = settings.youtube_dl_arguments[key]
                 for tries in range(1, 11):
                     try:
-                        with yt_dlp.YoutubeDL({'quiet': True,
-                                               'socket_timeout': '3',
-                                               'logger': log}) as ydl:
+                        with yt_dlp.YoutubeDL(arguments) as ydl:
                             youtube_info = ydl.extract_info(url['link'], download=False)
                             break
                     except yt_dlp.DownloadError as error:
@@ -235,7 +254,7 @@ class ExtraFinder:
         if self.record.tmdb_id:
             url_list += search_tmdb_by_id(self.record.tmdb_id,
                                           settings.extra_types,
-                                          self.record.media_type)
+                                          self.record.media_type) or []
             log.debug('urls: %s', url_list)
         else:
             log.error('tmdb_id is missing')
@@ -253,6 +272,38 @@ class ExtraFinder:
                     if not video['categories']:
                         self.play_trailers.append(video)
 
+    def load_prefetched(self, prefetch_path):
+        with open(prefetch_path, 'r', encoding='utf-8') as prefetch_file:
+            prefetch = json.load(prefetch_file)
+
+        if str(prefetch['tmdb_id']) != str(self.record.tmdb_id) \
+                or prefetch['media_type'] != self.record.media_type:
+            log.info('prefetched metadata is for %s %s, not %s %s. Ignoring it.',
+                     prefetch['media_type'], prefetch['tmdb_id'],
+                     self.record.media_type, self.record.tmdb_id)
+            return False
+        if time.time() - prefetch['created'] > settings.prefetch_max_age:
+            log.info('prefetched metadata is too old. Ignoring it.')
+            return False
+
+        self.youtube_videos = prefetch['videos']
+        self.play_trailers = [youtube_video for youtube_video in self.youtube_videos
+                              if not youtube_video['categories']]
+        return True
+
+    def save_prefetched(self, prefetch_path):
+        prefetch = {
+            'tmdb_id': self.record.tmdb_id,
+            'media_type': self.record.media_type,
+            'created': time.time(),
+            'videos': [yt_dlp.YoutubeDL.sanitize_info(youtube_video)
+                       for youtube_video in self.youtube_videos],
+        }
+        tmp_path = prefetch_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as prefetch_file:
+            json.dump(prefetch, prefetch_file, indent = 4)
+        os.replace(tmp_path, prefetch_path)
+
     def download_videos(self, tmp_file):
 
         downloaded_videos_meta = []
@@ -360,6 +411,8 @@ class Settings:
 
         self.tmp_folder_root = os.path.join(os.path.dirname(sys.argv[0]), 'tmp')
         self.record_folder = os.path.join(os.path.dirname(sys.argv[0]), 'records')
+        self.prefetch_folder = os.path.join(os.path.dirname(sys.argv[0]), 'prefetch')
+        self.prefetch_max_age = 7 * 24 * 60 * 60
         self.tmdb_api_url = 'https://api.themoviedb.org/3'
         self.tmdb_api_key = default_config.get('SETTINGS', 'tmdb_api_key')
         self.max_length = 200
@@ -369,9 +422,11 @@ class Settings:
 
 class Record:
 
-    def __init__(self):
+    def __init__(self, directory=None, tmdb_id=None):
 
-        self.tmdb_id = args.tmdbid
+        directory = directory or args.directory
+
+        self.tmdb_id = tmdb_id if tmdb_id is not None else args.tmdbid
         self.media_type = args.mediatype
         self.title = None
         if self.media_type == 'movie':
@@ -382,7 +437,7 @@ class Record:
             self.first_air_date = None
         self.extras = []
 
-        self.update_all()
+        self.update_all(directory)
 
     @classmethod
     def load_record(cls, file_name):
@@ -390,9 +445,9 @@ class Record:
             return Record()
 
 
-    def update_all(self):
+    def update_all(self, directory):
 
-        self.title = os.path.split(args.directory)[1]
+        self.title = os.path.split(directory)[1]
 
         def get_info_from_directory_name():
             clean_name_tuple = get_clean_string(self.title).split(' ')
@@ -536,7 +591,18 @@ class Record:
 def download_extra(record):
     finder = ExtraFinder(record)
     log.info('processing: %s', record.title)
-    finder.search()
+    prefetch_path = get_prefetch_path(args.directory)
+    prefetched = False
+    if not args.force and os.path.exists(prefetch_path):
+        try:
+            prefetched = finder.load_prefetched(prefetch_path)
+        except (json.JSONDecodeError, KeyError) as error:
+            log.error('Failed to load prefetched metadata %s : %s. Searching again.',
+                      prefetch_path, error)
+    if prefetched:
+        log.info('using prefetched metadata: %s', prefetch_path)
+    else:
+        finder.search()
 
     for youtube_video in finder.youtube_videos:
         log.info('extra_type: %s', youtube_video['extra_type'])
@@ -575,6 +641,9 @@ def download_extra(record):
     if downloaded_videos_meta:
         finder.move_videos(downloaded_videos_meta, tmp_folder)
 
+    if os.path.exists(prefetch_path):
+        os.remove(prefetch_path)
+
 
 def handle_directory():
     log.info('working on record: %s', args.directory)
@@ -600,12 +669,101 @@ def handle_directory():
     download_extra(record)
     record.save_record(settings.record_folder)
 
+
+def plan_directory(directory, tmdb_id=None):
+    record = Record(directory, tmdb_id)
+    plan_entry = {
+        'directory': directory,
+        'title': record.title,
+        'tmdb_id': record.tmdb_id,
+        'videos': [],
+        'estimated_bytes': 0,
+        'duration': 0,
+    }
+
+    if record.tmdb_id is None:
+        log.error('tmdb_id is missing for: %s', directory)
+        return plan_entry
+
+    finder = ExtraFinder(record)
+    log.info('planning: %s', record.title)
+    finder.search()
+    if finder.youtube_videos:
+        finder.save_prefetched(get_prefetch_path(directory))
+
+    for youtube_video in finder.youtube_videos:
+        estimated_bytes = estimate_video_size(youtube_video)
+        plan_entry['videos'].append({
+            'youtube_video_id': youtube_video['id'],
+            'title': youtube_video['title'],
+            'extra_type': youtube_video['extra_type'],
+            'webpage_url': youtube_video['webpage_url'],
+            'format': youtube_video['format'],
+            'duration': youtube_video['duration'],
+            'estimated_bytes': estimated_bytes,
+        })
+        plan_entry['estimated_bytes'] += estimated_bytes
+        plan_entry['duration'] += youtube_video['duration']
+
+    return plan_entry
+
+
+def plan_library(directories, tmdb_id=None):
+    plan = {
+        'media_type': args.mediatype,
+        'titles': [],
+        'estimated_bytes': 0,
+        'duration': 0,
+    }
+
+    if not os.path.isdir(settings.prefetch_folder):
+        os.mkdir(settings.prefetch_folder)
+
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [(directory, executor.submit(plan_directory, directory, tmdb_id))
+                   for directory in directories]
+        for directory, future in futures:
+            try:
+                plan_entry = future.result()
+            except Exception as error:
+                # one failing title should not abort planning the rest of the library
+                log.error('Failed to plan %s : %s. Skipping.', directory, error)
+                plan['titles'].append({'directory': directory, 'error': str(error)})
+                continue
+            plan['titles'].append(plan_entry)
+            plan['estimated_bytes'] += plan_entry['estimated_bytes']
+            plan['duration'] += plan_entry['duration']
+
+    return plan
+
+
+def handle_plan():
+    if args.library:
+        directories = sorted(os.path.join(args.library, name)
+                             for name in os.listdir(args.library)
+                             if os.path.isdir(os.path.join(args.library, name)))
+        plan = plan_library(directories)
+    else:
+        plan = plan_library([args.directory], args.tmdbid)
+
+    with open(args.plan, 'w', encoding='utf-8') as plan_file:
+        json.dump(plan, plan_file, indent = 4)
+
+    log.info('plan: %s titles, %s videos, %s bytes, %s seconds',
+             len(plan['titles']),
+             sum(len(plan_entry.get('videos', [])) for plan_entry in plan['titles']),
+             plan['estimated_bytes'],
+             plan['duration'])
+
 parser = argparse.ArgumentParser()
 parser.add_argument('-d', '--directory', help='directory to search extras for')
 parser.add_argument('-t', '--tmdbid', help='tmdb id to search extras for')
 parser.add_argument('-m', '--mediatype', help='media type to search extras for')
 parser.add_argument('-f', '--force', action='store_true', help='force scan the directories')
 parser.add_argument('-v', '--verbose', help='verbose mode', action="store_true")
+parser.add_argument('-l', '--library', help='library of directories to plan extras for')
+parser.add_argument('-p', '--plan', help='write a download plan to this file instead of downloading')
+parser.add_argument('-j', '--jobs', type=int, default=4, help='number of titles to plan concurrently')
 args = parser.parse_args()
 
 if args.directory and os.path.split(args.directory)[1] == '':
@@ -640,7 +798,17 @@ if not args.mediatype:
     log.error('please specify media type (-m) to search extras for')
     sys.exit(1)
 
-if args.directory:
+if args.jobs < 1:
+    log.error('please specify at least one job (-j) to plan with')
+    sys.exit(1)
+
+if args.library and args.tmdbid:
+    log.error('a tmdb id (-t) can not be used with a library (-l)')
+elif args.plan and (args.library or args.directory):
+    handle_plan()
+elif args.library:
+    log.error('a library (-l) can only be used with a plan (-p)')
+elif args.directory:
     handle_directory()
 else:
     log.error('please specify a directory (-d) to search extras for')